@@ -1,9 +1,18 @@
 # coding=utf-8
 from __future__ import absolute_import
 
+import logging
+import os
 import threading
 import usb1
 import re
+from timeit import default_timer as timer
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
 import octoprint.plugin
 from octoprint.settings import default_settings
 from octoprint.util import dict_merge
@@ -11,6 +20,19 @@ from octoprint.events import Events, eventManager
 
 from . import flashforge
 
+_logger = logging.getLogger("octoprint.plugins.flashforge")
+_settings_applied = False
+""" True once the FlashForge defaults have been merged into OctoPrint's default settings. """
+
+_GCODE_RE = re.compile(r'^[GMT]\d+')
+""" Regex matching the start of a valid G, M or T command in rewrite_gcode(). """
+_SD_ALLOWED = frozenset(["M24", "M25", "M26", "M27", "M105", "M110", "M112", "M114", "M115", "M117", "M400"])
+""" Commands allowed while printing from SD to minimize problems. """
+_HEATERS_OFF_CMDS = (b"M104 S0 T0", b"M104 S0 T1", b"M140 S0")
+""" Commands turning off the extruder and bed heaters before uploading to SD. """
+_M29_CMD = b"M29"
+""" Command ending an SD upload. """
+
 '''
 Special case support:
 
@@ -22,7 +44,8 @@ G91 (relative positioning) appears not to be supported by Finder 2, Guider 2 (F2
 
 class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 					   octoprint.plugin.AssetPlugin,
-					   octoprint.plugin.TemplatePlugin):
+					   octoprint.plugin.TemplatePlugin,
+					   octoprint.plugin.EventHandlerPlugin):
 	VENDOR_IDS = {0x0315: "PowerSpec", 0x2a89: "Dremel", 0x2b71: "FlashForge"}
 	PRINTER_PROFILES = {
 		0x0315: {
@@ -38,33 +61,61 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 			0x00e7: {"name": "Creator Max"}, 0x00ee: {"name": "Finder v2.12"},
 			0x00f6: {"name": "PowerSpec Ultra 3DPrinter (B)"},
 			0x00ff: {"name": "PowerSpec Ultra 3DPrinter (A)"}}}
-	FILE_PACKET_SIZE = 1024
+	# FlashForge friendly default connection settings
+	CONN_SETTINGS = {
+		'firmwareDetection': False,				# do not try to auto detect firmware
+		'sdAlwaysAvailable': True,				# FF printers always(?) have the internal SD card available
+		'neverSendChecksum': True,				# FF protocol does not use command checksums
+		'helloCommand': "M601 S0",				# FF hello command and set communication to USB
+		'abortHeatupOnCancel': False			# prevent sending of M108 command which doesn't work
+	}
+	FEATURE_SETTINGS = {
+		'autoUppercaseBlacklist': ['M146']		# LED control requires lowercase r,g,b
+	}
+	DETECT_CACHE_TTL = 3.0		# seconds to reuse the result of detect_printer() before enumerating USB devices again
+	FILE_PACKET_SIZE = 8192		# bigger bulk transfers mean fewer USB round trips when uploading to SD
 
 
 	def __init__(self):
-		import logging
-
-		self._logger = logging.getLogger("octoprint.plugins.flashforge")
+		self._logger = _logger
 		self._logger.debug("__init__")
 		self._comm = None
 		self._serial_obj = None
 		self._currentFile = None
 		self._usbcontext = None
 		self._printers = {}
+		self._printers_time = 0.0
 		self._printer_profile = {}
-		# FlashForge friendly default connection settings
-		self._conn_settings = {
-			'firmwareDetection': False,				# do not try to auto detect firmware
-			'sdAlwaysAvailable': True,				# FF printers always(?) have the internal SD card available
-			'neverSendChecksum': True,				# FF protocol does not use command checksums
-			'helloCommand': "M601 S0",				# FF hello command and set communication to USB
-			'abortHeatupOnCancel': False			# prevent sending of M108 command which doesn't work
+		self._no_g91 = False
+		global _settings_applied
+		if not _settings_applied:
+			# only change OctoPrint's defaults once even if the plugin gets created again
+			default_settings["serial"] = dict_merge(default_settings["serial"], self.CONN_SETTINGS)
+			default_settings["feature"] = dict_merge(default_settings["feature"], self.FEATURE_SETTINGS)
+			_settings_applied = True
+
+		# rewrite_gcode() handlers keyed by the gcode OctoPrint passes in
+		self._gcode_handlers = {
+			"G28": self._rewrite_G28,
+			"G91": self._rewrite_G91,
+			"M20": self._rewrite_drop,
+			"M21": self._rewrite_drop,
+			"M23": self._rewrite_M23,
+			"M25": self._rewrite_M25,
+			"M26": self._rewrite_M26,
+			"M82": self._rewrite_drop,
+			"M83": self._rewrite_drop,
+			"M84": self._rewrite_M84,
+			"M106": self._rewrite_M106,
+			"M108": self._rewrite_M108,
+			"M109": self._rewrite_M109,
+			"M110": self._rewrite_M110,
+			"M119": self._rewrite_drop,
+			"M132": self._rewrite_M132,
+			"M146": self._rewrite_M146,
+			"M190": self._rewrite_M190,
+			"T": self._rewrite_T
 		}
-		self._feature_settings = {
-			'autoUppercaseBlacklist': ['M146']		# LED control requires lowercase r,g,b
-		}
-		default_settings["serial"] = dict_merge(default_settings["serial"], self._conn_settings)
-		default_settings["feature"] = dict_merge(default_settings["feature"], self._feature_settings)
 
 		self._logger.info("libusb1: {}".format(usb1.__version__))
 
@@ -75,8 +126,10 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 		profiles = self._printer_profile_manager.get_all()
 		self._printer_profile_manager.default["ff"] = dict(noG91=False)
 		for k, profile in profiles.items():
-			profile = dict_merge(self._printer_profile_manager.default, profile)
-			self._printer_profile_manager.save(profile, True)
+			# only rewrite profiles that are missing our settings
+			if "ff" not in profile:
+				profile = dict_merge(self._printer_profile_manager.default, profile)
+				self._printer_profile_manager.save(profile, True)
 
 		# plugin default settings here
 		return dict(
@@ -121,13 +174,23 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 		if self._serial_obj:
 			return self._printers
 
+		# OctoPrint asks for the port list frequently, USB enumeration is slow so reuse recent results. If nothing was
+		# found last time then look again so a newly connected printer shows up straight away.
+		now = timer()
+		if self._printers and now - self._printers_time < self.DETECT_CACHE_TTL:
+			return self._printers
+
 		self._printers = {}
 		if not self._usbcontext:
 			self._usbcontext = usb1.USBContext()
 			self._usbcontext.open()
 
+		debug = self._logger.isEnabledFor(logging.DEBUG)
 		for device in self._usbcontext.getDeviceIterator(skip_on_error=True):
 			vendor_id = device.getVendorID()
+			if vendor_id not in self.VENDOR_IDS and not debug:
+				# reading the name requires USB I/O, only do it for other devices if we are going to log it
+				continue
 			device_id = device.getProductID()
 			device_name = 'unknown device'
 			try:
@@ -148,6 +211,9 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 				self._logger.info("Found a {} {}".format(vendor_name, device_name))
 				self._printers[device_name] = {'bus': bus, 'addr': addr, 'vid': vendor_id, 'did': device_id}
 
+		self._printers_time = now
+		return self._printers
+
 
 	def printer_factory(self, comm, portname, baudrate, read_timeout, *args, **kwargs):
 		""" OctoPrint hook - Called when creating printer connection
@@ -200,14 +266,24 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 	def on_connect(self, serial_obj):
 		self._logger.debug("on_connect()")
 		self._serial_obj = serial_obj
+		self._no_g91 = self.G91_disabled()
 
 
 	def on_disconnect(self):
 		self._logger.debug("on_disconnect()")
 		self._serial_obj = None
+		# the printer may have been unplugged or changed USB address so look for it again
+		self._printers_time = 0.0
+
 
+	##~~ EventHandlerPlugin mixin
+	def on_event(self, event, payload):
+		if event == Events.PRINTER_PROFILE_MODIFIED:
+			# ff.noG91 may have been changed by the user
+			self._no_g91 = self.G91_disabled()
 
-	# Flag F2G2
+
+	# Flag F2G2 - cached in self._no_g91 so we do not have to look up the profile for every command
 	def G91_disabled(self):
 		profile = self._printer_profile_manager.get_current_or_default()
 		return "ff" in profile and "noG91" in profile["ff"] and profile["ff"]["noG91"]
@@ -219,128 +295,163 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 		if self._serial_obj:
 
 			# Commands should begin with G,M,T
-			if not re.match(r'^[GMT]\d+', cmd):
+			if not _GCODE_RE.match(cmd):
 				# most likely part of the header in a .gx FlashPrint file
 				self._logger.debug("rewrite_gcode(): unrecognized command")
 				return []
 
-			self._logger.debug("rewrite_gcode(): gcode:{}, cmd:{}".format(gcode, cmd))
+			self._logger.debug("rewrite_gcode(): gcode:%s, cmd:%s", gcode, cmd)
 
 			# TODO: detect printer state earlier in connection process and don't send M146, etc if the printer
 			#  is already busy when we connect
 			# TODO: filter M146 and other commands? when printing from SD because they cause comms to hang
 
 			# allow a very limited set of commands while printing from SD to minimize problems...
-			if self._serial_obj.is_sd_printing() and gcode not in ["M24", "M25", "M26", "M27", "M105", "M110", "M112", "M114", "M115", "M117", "M400"]:
+			if self._serial_obj.is_sd_printing() and gcode not in _SD_ALLOWED:
 				cmd = []
+			else:
+				handler = self._gcode_handlers.get(gcode)
+				if handler:
+					cmd = handler(cmd, cmd_type, comm_instance)
 
-			# homing
-			elif gcode == "G28":
-				cmd = cmd.replace('0', '')
-				if cmd == "G28 X Y" and "noG28XY" in self._printer_profile:
-					# F2G2: does not support "G28 X Y"?
-					cmd = ["G28 X", "G28 Y"]
-
-			# relative positioning
-			elif gcode == "G91":
-				if self.G91_disabled():
-					# F2G2: try to convert relative positioning to absolute so add in some commands
-					self._serial_obj.disable_G91(True)
-					cmd = [("G91", cmd_type), "M114"]
-				else:
-					self._serial_obj.disable_G91(False)
-
-			# M20 list SD card, M21 init SD card - do not work and some printers may not respond causing timeouts,
-			# so ignore them
-			elif (gcode == "M20" or gcode == "M21"):
-				cmd = []
+			if cmd == []:
+				self._logger.debug("rewrite_gcode(): dropping command")
 
-			# M23 = select (and start printing) sd file
-			elif gcode == "M23":
-				# if the file path is incorrect (eg it came from Cura) then ignore the command
-				if "M23 /" in cmd:
-					cmd = []
-
-			# M25 = pause
-			elif gcode == "M25":
-				# pause during cancel causes issues
-				if comm_instance.isCancelling():
-					cmd = []
-
-			# M26 is sent by OctoPrint during SD prints:
-			# M26 in Marlin = set SD card position : FlashForge = cancel
-			elif gcode == "M26":
-				# M26 S0 generated during OctoPrint cancel - use it to send cancel
-				if (cmd == "M26 S0" and comm_instance.isCancelling()) or cmd == "M26":
-					cmd = [("M26", cmd_type)]
-				else:
-					cmd = []
-
-			# M82 in Marlin = extruder abs positioning : FlashForge = undefined?
-			elif gcode == "M82":
-				cmd = []
+		return cmd
 
-			# M83 in Marlin = extruder rel positioning : FlashForge = undefined?
-			elif gcode == "M83":
-				cmd = []
 
-			# M84 by default sent when OctoPrint cancelling print
-			# M84 in Marlin = disable steppers : M18 is FlashForge equivalent
-			elif gcode == "M84":
-				cmd = ["M18"]
-
-			# M106 S0 is sent by OctoPrint control panel:
-			# M106 S0 in Marlin = fan off : M107 is FlashForge equivalent
-			elif gcode == "M106":
-				if "S0" in cmd:
-					cmd = ["M107"]
-
-			# M108 is sent by OctoPrint during SD cancel if abortHeatupOnCancel is set:
-			# M108 in Marlin = stop heat wait & continue : FlashForge M108 Tx = change toolhead (no equivalent?),
-			# drop if this is the command
-			elif cmd == "M108":
-				cmd = []
+	##~~ rewrite_gcode() handlers: take the queued command and return the (possibly rewritten) command(s)
 
-			# M109 in Marlin = wait for extruder temp : M6 in FlashForge (this may need to be moved to the write() method)
-			elif gcode == "M109":
-				cmd = [cmd.replace("M109", "M6")]
-
-			# M110 is sent by OctoPrint as default hello but also when connected:
-			# M110 Set line number/hello in Marlin : FlashForge uses M601 S0 to take control via USB
-			elif gcode == "M110":
-				# if we connected and the printer is already printing then trigger an M27 so we can trigger a file open
-				# for OctoPrint
-				if self._serial_obj.is_sd_printing() and not self._comm.isSdFileSelected():
-					cmd = ["M27"]
-				else:
-					cmd = []
-
-			# M119 get status we generate automatically so skip this
-			elif gcode == "M119":
-				cmd = []
+	def _rewrite_drop(self, cmd, cmd_type, comm_instance):
+		"""Drop commands that are undefined or unnecessary on FlashForge
 
-			# M132 load default positions does not work at command line for some printers
-			elif gcode == "M132" and "noM132" in self._printer_profile:
-				cmd = []
+		M20 list SD card, M21 init SD card - do not work and some printers may not respond causing timeouts
+		M82/M83 in Marlin = extruder abs/rel positioning : FlashForge = undefined?
+		M119 get status we generate automatically so skip this
+		"""
+		return []
 
-			# M146 = set LED colors: do not send while printing from SD (does not work, may cause issues)
-			elif gcode == "M146" and self._serial_obj.is_sd_printing():
-				cmd = []
 
-			# M190 in Marlin = wait for bed temp : M7 in FlashForge
-			elif gcode == "M190":
-				cmd = [cmd.replace("M190", "M7")]
+	def _rewrite_G28(self, cmd, cmd_type, comm_instance):
+		"""Homing"""
+		# OctoPrint sends eg "G28 X0 Y0" - drop the 0 from the axes without touching any other numbers
+		cmd = " ".join(p[0] if p in ("X0", "Y0", "Z0") else p for p in cmd.split())
+		if cmd == "G28 X Y" and "noG28XY" in self._printer_profile:
+			# F2G2: does not support "G28 X Y"?
+			cmd = ["G28 X", "G28 Y"]
+		return cmd
 
-			# Tx = select extruder : FlashForge uses M108
-			elif gcode == "T":
-				cmd = [("M108 %s" % cmd, cmd_type)]
 
-			if cmd == []:
-				self._logger.debug("rewrite_gcode(): dropping command")
+	def _rewrite_G91(self, cmd, cmd_type, comm_instance):
+		"""Relative positioning"""
+		if self._no_g91:
+			# F2G2: try to convert relative positioning to absolute so add in some commands
+			self._serial_obj.disable_G91(True)
+			cmd = [("G91", cmd_type), "M114"]
+		else:
+			self._serial_obj.disable_G91(False)
+		return cmd
+
+
+	def _rewrite_M23(self, cmd, cmd_type, comm_instance):
+		"""M23 = select (and start printing) sd file"""
+		# if the file path is incorrect (eg it came from Cura) then ignore the command
+		if "M23 /" in cmd:
+			cmd = []
+		return cmd
+
+
+	def _rewrite_M25(self, cmd, cmd_type, comm_instance):
+		"""M25 = pause"""
+		# pause during cancel causes issues
+		if comm_instance.isCancelling():
+			cmd = []
+		return cmd
 
+
+	def _rewrite_M26(self, cmd, cmd_type, comm_instance):
+		"""M26 is sent by OctoPrint during SD prints
+
+		M26 in Marlin = set SD card position : FlashForge = cancel
+		"""
+		# M26 S0 generated during OctoPrint cancel - use it to send cancel
+		if (cmd == "M26 S0" and comm_instance.isCancelling()) or cmd == "M26":
+			return [("M26", cmd_type)]
+		return []
+
+
+	def _rewrite_M84(self, cmd, cmd_type, comm_instance):
+		"""M84 by default sent when OctoPrint cancelling print
+
+		M84 in Marlin = disable steppers : M18 is FlashForge equivalent
+		"""
+		return ["M18"]
+
+
+	def _rewrite_M106(self, cmd, cmd_type, comm_instance):
+		"""M106 S0 is sent by OctoPrint control panel
+
+		M106 S0 in Marlin = fan off : M107 is FlashForge equivalent
+		"""
+		# match the parameter exactly so eg "M106 S05" or "M106 P1 S05" is not mistaken for fan off
+		if "S0" in cmd.split()[1:]:
+			cmd = ["M107"]
+		return cmd
+
+
+	def _rewrite_M108(self, cmd, cmd_type, comm_instance):
+		"""M108 is sent by OctoPrint during SD cancel if abortHeatupOnCancel is set
+
+		M108 in Marlin = stop heat wait & continue : FlashForge M108 Tx = change toolhead (no equivalent?),
+		drop if this is the command
+		"""
+		if cmd == "M108":
+			cmd = []
+		return cmd
+
+
+	def _rewrite_M109(self, cmd, cmd_type, comm_instance):
+		"""M109 in Marlin = wait for extruder temp : M6 in FlashForge (this may need to be moved to the write() method)"""
+		# the gcode is always at the start of the command
+		return ["M6" + cmd[4:]]
+
+
+	def _rewrite_M110(self, cmd, cmd_type, comm_instance):
+		"""M110 is sent by OctoPrint as default hello but also when connected
+
+		M110 Set line number/hello in Marlin : FlashForge uses M601 S0 to take control via USB
+		"""
+		# if we connected and the printer is already printing then trigger an M27 so we can trigger a file open
+		# for OctoPrint
+		if self._serial_obj.is_sd_printing() and not self._comm.isSdFileSelected():
+			return ["M27"]
+		return []
+
+
+	def _rewrite_M132(self, cmd, cmd_type, comm_instance):
+		"""M132 load default positions does not work at command line for some printers"""
+		if "noM132" in self._printer_profile:
+			cmd = []
+		return cmd
+
+
+	def _rewrite_M146(self, cmd, cmd_type, comm_instance):
+		"""M146 = set LED colors: do not send while printing from SD (does not work, may cause issues)"""
+		if self._serial_obj.is_sd_printing():
+			cmd = []
 		return cmd
 
 
+	def _rewrite_M190(self, cmd, cmd_type, comm_instance):
+		"""M190 in Marlin = wait for bed temp : M7 in FlashForge"""
+		return ["M7" + cmd[4:]]
+
+
+	def _rewrite_T(self, cmd, cmd_type, comm_instance):
+		"""Tx = select extruder : FlashForge uses M108"""
+		return [("M108 %s" % cmd, cmd_type)]
+
+
 	# Uploading files directly to internal SD card
 	def upload_to_sd(self, printer, filename, path, sd_upload_started, sd_upload_succeeded, sd_upload_failed, *args,
 					 **kwargs):
@@ -348,8 +459,6 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 
 		Note the filename can contain a sub-folder path to the place on OctoPrint where the file is located!
 		"""
-		from timeit import default_timer as timer
-
 		if not self._serial_obj:
 			return
 
@@ -370,16 +479,14 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 			self._serial_obj.makeexclusive(True)
 			self._serial_obj.enable_keep_alive(False)
 
-			# make sure heaters are off
-			ok, answer = self._serial_obj.sendcommand(b"M104 S0 T0")
+			# make sure heaters are off, only the first one has to succeed since the printer may not have a second
+			# extruder
+			ok, answer = self._serial_obj.sendcommands(_HEATERS_OFF_CMDS)[0]
 			if not ok:
 				error = "{}: {}".format(errormsg, answer)
 				errormsg += " - printer busy."
 			else:
-				self._serial_obj.sendcommand(b"M104 S0 T1")
-				self._serial_obj.sendcommand(b"M140 S0")
-
-				ok, answer = self._serial_obj.sendcommand(b"M28 %d 0:/user/%s" % (file_size, remote_name.encode()), 5000)
+				ok, answer = self._serial_obj.sendcommand(b"M28 %d 0:/user/%s" % (file_size, remote_name_b), 5000)
 				if not ok or b"open failed" in answer:
 					error = "{}: {}".format(errormsg, answer)
 					errormsg += " - could not create file on printer SD card."
@@ -388,25 +495,75 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 				self._logger.debug("M28 file tx started")
 
 				try:
-					chunk_start_index = 0
-					while chunk_start_index < file_size:
-						chunk_end_index = min(chunk_start_index + self.FILE_PACKET_SIZE, file_size)
-						chunk = bgcode[chunk_start_index:chunk_end_index]
-						if not chunk:
-							error = "unexpected eof"
-							break
-
-						if self._serial_obj.writeraw(chunk, False):
-							upload_percent = int(100.0 * chunk_end_index / file_size)
-							self._logger.debug("Sent: %d%% %d/%d" % (upload_percent, chunk_end_index, file_size))
-						else:
-							error = "file transfer interrupted"
-							break
-
-						chunk_start_index += self.FILE_PACKET_SIZE
+					sent = 0
+					last_percent = -1
+					# read the file in a separate thread so disk reads overlap with USB writes. Chunks are read into a
+					# small pool of reusable buffers which are passed to USB without copying and keep memory use bounded
+					chunks = queue.Queue()
+					buffers = queue.Queue()
+					for i in range(4):
+						buffers.put(bytearray(self.FILE_PACKET_SIZE))
+					stop_reading = threading.Event()
+
+					def read_file():
+						try:
+							with open(path, "rb") as gcode_file:
+								# never send more than the size given to M28 even if the file changed since
+								remaining = file_size
+								while remaining:
+									buf = buffers.get()
+									if stop_reading.is_set():
+										break
+									view = memoryview(buf)
+									length = gcode_file.readinto(view[:min(self.FILE_PACKET_SIZE, remaining)])
+									if not length:
+										break
+									remaining -= length
+									chunks.put((buf, view[:length]))
+						except (IOError, OSError) as ioerror:
+							chunks.put(ioerror)
+						chunks.put(None)
+
+					reader = threading.Thread(target=read_file, name="FlashForge.SD_Reader")
+					reader.daemon = True
+					reader.start()
+					try:
+						while True:
+							chunk = chunks.get()
+							if chunk is None:
+								if sent < file_size:
+									error = "unexpected eof"
+								break
+							if isinstance(chunk, Exception):
+								error = "could not read local file"
+								break
+
+							buf, data = chunk
+							ok = self._serial_obj.writeraw(data, False)
+							buffers.put(buf)
+							if ok:
+								sent += len(data)
+								# only log when the percentage changes
+								upload_percent = sent * 100 // file_size
+								if upload_percent != last_percent:
+									last_percent = upload_percent
+									self._logger.debug("Sent: %d%% %d/%d", upload_percent, sent, file_size)
+							else:
+								error = "file transfer interrupted"
+								break
+					finally:
+						# if we stopped early the reader may be waiting for a free buffer
+						stop_reading.set()
+						while reader.is_alive():
+							try:
+								chunk = chunks.get_nowait()
+								if isinstance(chunk, tuple):
+									buffers.put(chunk[0])
+							except queue.Empty:
+								reader.join(0.1)
 
 					if not error:
-						result, response = self._serial_obj.sendcommand(b"M29", 10000)
+						result, response = self._serial_obj.sendcommand(_M29_CMD, 10000)
 						if result and b"CMD M28" in response:
 							response = self._serial_obj.readraw(1000)
 						if result and b"failed" not in response:
@@ -439,19 +596,15 @@ class FlashForgePlugin(octoprint.plugin.SettingsPlugin,
 		start = timer()
 		# Unfortunately we cannot get the list of files on the SD card from FlashForge so we just name the remote
 		# file the same as the source and hope for the best
-		bgcode = b""
-		file_size = 0
 		remote_name = filename.split("/")[-1]
+		remote_name_b = remote_name.encode()
 
 		self._logger.info("Starting SDCard upload from {} to {}".format(filename, remote_name))
 		sd_upload_started(filename, remote_name)
 
 		try:
-			file = open(path, "rb")
-			bgcode = file.read()
-			file_size = len(bgcode)
-			file.close()
-		except:
+			file_size = os.path.getsize(path)
+		except OSError:
 			errormsg = "could not open local file."
 			self._logger.info("aborting: " + errormsg)
 			sd_upload_failed(filename, remote_name, timer()-start)
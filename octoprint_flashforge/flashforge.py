@@ -1,6 +1,8 @@
+import logging
 import usb1
 import threading
 import re
+from timeit import default_timer as timer
 
 try:
 	import queue
@@ -10,6 +12,8 @@ except ImportError:
 from octoprint.settings import settings
 from octoprint.events import Events, eventManager
 
+_logger = logging.getLogger("octoprint.plugins.flashforge")
+
 
 class FlashForgeError(Exception):
 	def __init__(self, message, error=0):
@@ -19,6 +23,8 @@ class FlashForgeError(Exception):
 
 class FlashForge(object):
 	BUFFER_SIZE = 512
+	STATUS_INTERVAL = 2.0		# seconds between M119 status requests sent by keep_alive()
+	KEEP_ALIVE_MIN_WAIT = 0.1	# shortest time keep_alive() will sleep for
 
 	STATE_UNKNOWN = 0
 	STATE_READY = 1
@@ -29,11 +35,12 @@ class FlashForge(object):
 	STATE_BUSY = 6
 	STATE_WAIT_ON_TEMP = 7
 
-	PRINTING_STATES = [STATE_BUILDING, STATE_SD_BUILDING, STATE_SD_PAUSED]
+	PRINTING_STATES = frozenset([STATE_BUILDING, STATE_SD_BUILDING, STATE_SD_PAUSED])
+	SD_PRINTING_STATES = frozenset([STATE_SD_BUILDING, STATE_SD_PAUSED])
 
 	regex_SDPrintProgress = re.compile(b"(?P<current>[0-9]+)/(?P<total>[0-9]+)")
 	""" Regex matching SD print progress from M27. """
-	regex_gcode = re.compile(b"^(N[0-9]+\s+)?(?P<gcode>[GM][0-9]+)(\s+(?P<payload>.+))?")
+	regex_gcode = re.compile(br"^(N[0-9]+\s+)?(?P<gcode>[GM][0-9]+)(\s+(?P<payload>.+))?")
 	""" Regex matching gcodes in write(). """
 	regex_g1 = re.compile(
 		b"G[01](?=.* X(?P<X>-?[0-9.]+))?(?=.* Y(?P<Y>-?[0-9.]+))?(?=.* Z(?P<Z>-?[0-9.]+))?(?=.* E(?P<E>-?[0-9.]+))?(?=.* F(?P<F>[0-9.]+))?")
@@ -43,8 +50,7 @@ class FlashForge(object):
 	""" Regex matching position values from M114 """
 
 	def __init__(self, plugin, comm, usbcontext, portname, printer, read_timeout=10.0, write_timeout=10.0):
-		import logging
-		self._logger = logging.getLogger("octoprint.plugins.flashforge")
+		self._logger = _logger
 		self._logger.debug("__init__()")
 
 		self._plugin = plugin
@@ -55,9 +61,10 @@ class FlashForge(object):
 		self._read_timeout = read_timeout
 		self._write_timeout = write_timeout
 		self._keep_alive_t = None
+		self._keep_alive_stop = threading.Event()
 		self._keep_alive_enabled = False
-		self._status_time = 0.0
-		self._temp_time = 0.0
+		self._status_time = 0.0		# time the last status request was sent
+		self._temp_time = 0.0		# time the last temp request was sent
 		self._temp_interval = 0.0
 		self._autotemp_enabled = True
 		self._is_autotemp = False
@@ -116,19 +123,23 @@ class FlashForge(object):
 
 		self._logger.debug("claimed USB interface")
 		device = self._handle.getDevice()
+		# only query the descriptors needed for the debug output if it is going to be logged
+		debug = self._logger.isEnabledFor(logging.DEBUG)
 		# look for an in and out endpoint pair:
 		for configuration in device.iterConfigurations():
 			for interface in configuration:
 				for setting in interface:
-					self._logger.debug(" setting number: 0x{:02x}, class: 0x{:02x}, subclass: 0x{:02x}, protocol: 0x{:02x}, #endpoints: {}".format(
-						setting.getNumber(), setting.getClass(), setting.getSubClass(), setting.getProtocol(), setting.getNumEndpoints()))
+					if debug:
+						self._logger.debug(" setting number: 0x{:02x}, class: 0x{:02x}, subclass: 0x{:02x}, protocol: 0x{:02x}, #endpoints: {}".format(
+							setting.getNumber(), setting.getClass(), setting.getSubClass(), setting.getProtocol(), setting.getNumEndpoints()))
 					endpoint_in = 0
 					endpoint_out = 0
 					for endpoint in setting:
-						self._logger.debug("  found endpoint type {} at address 0x{:02x}, max packet size {}".
-							format(usb1.libusb1.libusb_transfer_type.get(endpoint.getAttributes()),
-							endpoint.getAddress(),
-							endpoint.getMaxPacketSize()))
+						if debug:
+							self._logger.debug("  found endpoint type {} at address 0x{:02x}, max packet size {}".
+								format(usb1.libusb1.libusb_transfer_type.get(endpoint.getAttributes()),
+								endpoint.getAddress(),
+								endpoint.getMaxPacketSize()))
 						if usb1.libusb1.libusb_transfer_type.get(endpoint.getAttributes()) == 'LIBUSB_TRANSFER_TYPE_BULK':
 							address = endpoint.getAddress()
 							if address & usb1.ENDPOINT_IN:
@@ -219,36 +230,37 @@ class FlashForge(object):
 		"""Keep printer connection alive
 
 		Some printers drop the connection if they don't receive something at least every 4s, so we will send M119 to
-		get status every few seconds.
+		get status every STATUS_INTERVAL seconds.
 		Also use for auto-reporting temperature so we can pass temp to Octoprint when the print queue is blocked by
 		printer waiting for heatup, etc otherwise OctoPrint will think the printer is not responding...
 		"""
-		exit_flag = threading.Event()
-		self._status_time = 0.0
-		self._temp_time = 0.0
-		keep_alive = 0.5
-		self._logger.debug("keep_alive() set to:{}".format(keep_alive))
+		self._status_time = self._temp_time = timer()
+		self._logger.debug("keep_alive() status every:{}s".format(self.STATUS_INTERVAL))
 		# do not queue commands if the connection is going away
 		while self._handle and not self._disconnect_event:
+			now = timer()
+			# sleep until the next status or temp report is due rather than polling, close() wakes us up
+			wait = self.STATUS_INTERVAL
 			if self._keep_alive_enabled:
 				# even though we have blocking on the write() routine we do not want to try to write while uploading to
 				# SD etc since it can generate confusion when the upload completes and a keep alive goes through at the
 				# same time
-				self._temp_time += keep_alive
-				if self._temp_interval and self._temp_time >= self._temp_interval:
+				if self._temp_interval and now - self._temp_time >= self._temp_interval:
 					# do the fake auto reporting of temp OctoPrint
 					self._is_autotemp = True
 					self.write(b"M105")
-					self._temp_time = 0.0
-				self._status_time += keep_alive
-				if self._status_time >= 2.0:
+					self._temp_time = now
+				if now - self._status_time >= self.STATUS_INTERVAL:
 					# get status every 2s so printer gets something during long ops
 					# Dremel 3D20 seems to require something at least every 2s - other FF printers seem to be able to wait up to 3.5s
 					# may want to make this a setting
 					self.write(b"M119")
-					self._status_time = 0.0
-			if exit_flag.wait(timeout=keep_alive):
-				exit()
+					self._status_time = now
+				wait = self._status_time + self.STATUS_INTERVAL - now
+				if self._temp_interval:
+					wait = min(wait, self._temp_time + self._temp_interval - now)
+			if self._keep_alive_stop.wait(max(wait, self.KEEP_ALIVE_MIN_WAIT)):
+				break
 		self._logger.debug("keep_alive() exiting")
 
 
@@ -259,29 +271,25 @@ class FlashForge(object):
 		"""
 		self._logger.debug("enable_keep_alive({})".format(enable))
 		self._keep_alive_enabled = enable
-		self._temp_time = 0.0
-		self._status_time = 0.0
+		self._temp_time = self._status_time = timer()
 
 
 	def is_ready(self):
 		"""Return true if the printer is idle"""
 
-		self._logger.debug("is_ready()")
 		return self._printerstate == self.STATE_READY
 
 
 	def is_printing(self):
 		"""Return true if the printer is in any printing state"""
 
-		self._logger.debug("is_printing()")
 		return self._printerstate in self.PRINTING_STATES
 
 
 	def is_sd_printing(self):
-		"""Return true if the printer is in any printing state"""
+		"""Return true if the printer is printing from SD, including paused"""
 
-		self._logger.debug("is_sd_printing()")
-		return self._printerstate in [self.STATE_SD_PAUSED, self.STATE_SD_BUILDING]
+		return self._printerstate in self.SD_PRINTING_STATES
 
 
 	def disable_autotemp(self):
@@ -300,7 +308,8 @@ class FlashForge(object):
 		Formats the commands sent by OctoPrint to make them FlashForge friendly.
 		"""
 
-		self._logger.debug("write() called by thread {}".format(threading.currentThread().getName()))
+		if self._logger.isEnabledFor(logging.DEBUG):
+			self._logger.debug("write() called by thread %s", threading.currentThread().getName())
 		if not self._handle:
 			# do not queue commands if the connection is going away
 			return
@@ -317,7 +326,8 @@ class FlashForge(object):
 		# try to filter out garbage commands (we need to replace with something harmless)
 		# do this here instead of octoprint.comm.protocol.gcode.sending hook so DisplayLayerProgress plugin will work
 		if len(data) and not self._valid_command(data):
-			self._logger.debug("filtering command {0}".format(data.decode()))
+			if self._logger.isEnabledFor(logging.DEBUG):
+				self._logger.debug("filtering command %s", data.decode())
 			data = b"M105"
 		else:
 			cmd = data.split(b' ', 1)
@@ -330,7 +340,7 @@ class FlashForge(object):
 				self._logger.debug("G0/G1 with rel pos")
 				match = FlashForge.regex_g1.search(data)
 				if match:
-					self._logger.debug("G1 {}".format(match.groupdict()))
+					self._logger.debug("G1 %s", match.groupdict())
 					data = b"G1"
 					for k, v in match.groupdict().items():
 						if v != None:
@@ -338,7 +348,7 @@ class FlashForge(object):
 								v = self._pos[k] + float(v)
 								data += b" %s%06.4f" % (k.encode(), v)
 							elif k == 'E':
-								self._logger.debug("extruder {}, {}".format(self._extruder, self._pos[self._extruder]))
+								self._logger.debug("extruder %s, %s", self._extruder, self._pos[self._extruder])
 								v = self._pos[self._extruder] + float(v)
 								data += b" %s%06.4f" % (k.encode(), v)
 							else:
@@ -352,25 +362,26 @@ class FlashForge(object):
 					data = b"G90"
 			elif gcode == b"M23":
 				# we started an SD print - make sure to set printer state
-				self._status_time = 0.0
+				self._status_time = timer()
 				data += b"\r\n~M119"
 			elif gcode == b"M27":
 				# make sure we have the current printer status before getting SD card progress, because SD card
 				# progress reports printing when cancelled or finished...
-				self._status_time = 0.0
+				self._status_time = timer()
 				data = b"M119\r\n~M27"
 			elif gcode == b"M105":
-				self._temp_time = 0.0
+				self._temp_time = timer()
 			elif gcode == b"M108":
 				self._extruder = "E1" if b"T1" in payload else "E0"
-				self._logger.debug("select extruder {0}".format(self._extruder))
+				self._logger.debug("select extruder %s", self._extruder)
 			elif gcode == b"M601":
 				# make sure we have the current printer status as soon as we connect
-				self._status_time = 0.0
+				self._status_time = timer()
 				data += b"\r\n~M119"
 
 		try:
-			self._logger.debug("write() {0}".format(data.decode()))
+			if self._logger.isEnabledFor(logging.DEBUG):
+				self._logger.debug("write() %s", data.decode())
 			self._handle.bulkWrite(self._usb_cmd_endpoint_out, b"~%s\r\n" % data, int(self._write_timeout * 1000.0))
 			self._writelock.release()
 			return data_len
@@ -382,11 +393,12 @@ class FlashForge(object):
 	def writeraw(self, data, command = True):
 		"""Write raw data to printer.
 
-		data: bytearray to send
+		data: bytes or writable buffer (eg bytearray, memoryview) to send - writable buffers are sent without copying
 		command: True to send g-code, False to send to upload SD card
 		"""
 
-		self._logger.debug("writeraw() called by thread {}".format(threading.currentThread().getName()))
+		if self._logger.isEnabledFor(logging.DEBUG):
+			self._logger.debug("writeraw() called by thread %s", threading.currentThread().getName())
 
 		try:
 			self._handle.bulkWrite(self._usb_cmd_endpoint_out if command else self._usb_sd_endpoint_out, data)
@@ -405,7 +417,8 @@ class FlashForge(object):
 			List of lines returned from the printer
 		"""
 
-		self._logger.debug("readline() called by thread {}".format(threading.currentThread().getName()))
+		if self._logger.isEnabledFor(logging.DEBUG):
+			self._logger.debug("readline() called by thread %s", threading.currentThread().getName())
 
 		self._readlock.acquire()
 
@@ -452,7 +465,7 @@ class FlashForge(object):
 							if self._printerstate == self.STATE_READY and current >= total:
 								# Ultra 3D: after completing print it still indicates SD card progress
 								data = b"CMD M27 Received.\r\nDone printing file\r\nok\r\n"
-							elif self._printerstate in [self.STATE_SD_PAUSED, self.STATE_SD_BUILDING] and \
+							elif self._printerstate in self.SD_PRINTING_STATES and \
 								not self._comm.isSdFileSelected():
 								# user manually started a print or we connected while one was running
 								data = b"File opened: SD_printing.gcode Size: %d\r\nok\r\n" % total
@@ -483,7 +496,7 @@ class FlashForge(object):
 					data = data.replace(b"CMD M105 Received.\r\n", b"")
 					# TODO: add " W:?" to the string to indicate that the printer is waiting to get to temp if state
 					#  indicates waiting on tool or bed. This should prevent OctoPrint from triggering timeouts?
-					if not (b"CMD " in data and self._printerstate in [self.STATE_SD_BUILDING, self.STATE_SD_PAUSED]):
+					if not (b"CMD " in data and self._printerstate in self.SD_PRINTING_STATES):
 						# do not drop the "ok" if there is the response to another command in here and we are printing from SD?
 						data = data.replace(b"\r\nok", b"")
 				self._is_autotemp = False
@@ -496,7 +509,7 @@ class FlashForge(object):
 					for k, v in match.groupdict().items():
 						if v != None:
 							self._pos[k] = float(v)
-					self._logger.debug("pos: {}".format(self._pos))
+					self._logger.debug("pos: %s", self._pos)
 
 			elif b"CMD M115 " in data:
 				# Try to make the firmware response more readable by OctoPrint
@@ -548,7 +561,7 @@ class FlashForge(object):
 				# turn data into list of lines
 				datalines = data.splitlines()
 				for i, line in enumerate(datalines):
-					self._logger.debug("buffering: {}".format(line))
+					self._logger.debug("buffering: %s", line)
 					self._incoming.put(line)
 			else:
 				self._incoming.put(data)
@@ -573,7 +586,8 @@ class FlashForge(object):
 		data = b""
 		if timeout == -1:
 			timeout = int(self._read_timeout * 1000.0)
-		self._logger.debug("readraw() called by thread: {}, timeout: {}".format(threading.currentThread().getName(), timeout))
+		if self._logger.isEnabledFor(logging.DEBUG):
+			self._logger.debug("readraw() called by thread: %s, timeout: %s", threading.currentThread().getName(), timeout)
 
 		try:
 			# read data from USB until ok signals end or timeout
@@ -584,7 +598,8 @@ class FlashForge(object):
 		except usb1.USBError as usberror:
 			raise FlashForgeError("USB Error readraw()", usberror)
 
-		self._logger.debug("readraw() returns: {}".format(data.decode().replace("\r\n", " | ")))
+		if self._logger.isEnabledFor(logging.DEBUG):
+			self._logger.debug("readraw() returns: %s", data.decode().replace("\r\n", " | "))
 		return data
 
 
@@ -602,7 +617,8 @@ class FlashForge(object):
 			Optional : string containing response from the printer
 		"""
 
-		self._logger.debug("sendcommand() {}".format(cmd.decode()))
+		if self._logger.isEnabledFor(logging.DEBUG):
+			self._logger.debug("sendcommand() %s", cmd.decode())
 
 		self.writeraw(b"~%s\r\n" % cmd)
 		if not readresponse:
@@ -627,6 +643,50 @@ class FlashForge(object):
 		return False, response
 
 
+	def sendcommands(self, cmds, timeout=1000):
+		"""
+		Send several g-code commands to the printer in a single USB transfer and wait for the responses
+
+		Parameters:
+			cmds : list of FF formatted g-code commands
+			timeout : max time to wait in ms for each read
+
+		Returns:
+			List with a (ok, response) tuple for each command as returned by sendcommand()
+		"""
+
+		self._logger.debug("sendcommands() {}".format(b" | ".join(cmds).decode()))
+
+		self.writeraw(b"".join(b"~%s\r\n" % cmd for cmd in cmds))
+
+		# read responses until we have one for every command we sent
+		gcodes = [b"CMD %s " % cmd.split(b" ", 1)[0] for cmd in cmds]
+		response = b""
+		while True:
+			data = self.readraw(timeout)
+			if not data:
+				break
+			if not any(gcode in data for gcode in gcodes):
+				# we got the response from some previous OctoPrint command so parse it into the buffer used for
+				# OctoPrint listener so it will be read later
+				self._parse_response(data)
+				continue
+			response += data
+			if all(response.count(gcode) >= gcodes.count(gcode) for gcode in gcodes):
+				break
+
+		# split the responses up and match them to the commands in order
+		responses = [b"CMD " + r for r in response.split(b"CMD ")[1:]]
+		results = []
+		for gcode in gcodes:
+			answer = next((r for r in responses if r.startswith(gcode)), b"")
+			if answer:
+				responses.remove(answer)
+			# note that sometimes the ok response is not terminated with \r\n eg M104 on Dreamer
+			results.append((b"\r\nok" in answer, answer))
+		return results
+
+
 	def makeexclusive(self, exclusive):
 		"""	Obtain exclusive use of the connection for the current thread"""
 
@@ -644,6 +704,7 @@ class FlashForge(object):
 		self._logger.debug("close()")
 
 		self._disconnect_event = True
+		self._keep_alive_stop.set()
 		if self._keep_alive_t:
 			self._keep_alive_t.join()
 